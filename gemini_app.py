@@ -6,36 +6,196 @@ Mimics Claude's artifact editing system for precise code modifications
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
+import tkinter.font as tkfont
+import ast
+import hashlib
+import importlib.util
 import json
 import threading
-import subprocess
 import sys
 import os
 import time
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+from typing import Dict, List, Literal, Optional, Tuple, get_args
+from dataclasses import dataclass, field
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import re
 
-# Import required libraries with fallback handling
-try:
-    import google.generativeai as genai
-    GENAI_AVAILABLE = True
-except ImportError:
-    GENAI_AVAILABLE = False
-    # The main function will handle informing the user and attempting installation.
-    # print("Warning: google-generativeai not installed. AI features will be disabled.")
+def _module_available(name):
+    """Check whether a module can be imported without actually importing it"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:  # Parent package is missing
+        return False
 
-try:
-    import pygments # Check if the base module is available
-    from pygments.lexers import PythonLexer # Keep if planning to use lexing
-    # from pygments.formatters import NullFormatter # Not used
-    # from pygments import highlight # Not used
-    PYGMENTS_AVAILABLE = True
-except ImportError:
-    PYGMENTS_AVAILABLE = False
-    # The main function will handle informing the user and attempting installation.
+# Optional dependencies are only located here; the heavy Gemini SDK (grpc,
+# protobuf, google.auth) is imported on first use by _lazy_genai().
+# The main function will handle informing the user and attempting installation.
+genai = None
+GENAI_AVAILABLE = _module_available("google.genai")
 
-@dataclass
+# The JSON fast paths and asyncio are only needed once the AI is used, so
+# they are imported on first use too, keeping them off the startup path
+ORJSON_AVAILABLE = _module_available("orjson")  # Else the standard library json module
+MSGSPEC_AVAILABLE = _module_available("msgspec")  # Else parse and validate by hand
+
+# The API key is remembered in the OS keyring when keyring is installed
+KEYRING_AVAILABLE = _module_available("keyring")
+KEYRING_SERVICE = "ai_code_editor"
+KEYRING_USERNAME = "gemini"
+
+# Modules main() requires before starting, with the pip package providing each.
+# Pygments is for syntax highlighting, potentially optional but good to have;
+# for now it is treated as core for the app's intended functionality.
+CORE_DEPENDENCIES = [
+    ("google.genai", "google-genai"),
+    ("pygments", "Pygments"),
+]
+
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+AI_CACHE_SIZE = 64  # AI response payloads kept per session
+AI_CONTEXT_MIN_LINES = 300  # Shorter files are always sent to the AI whole
+FILE_READ_CHUNK_SIZE = 1024 * 1024
+FILE_WRITE_CHUNK_SIZE = 64 * 1024
+EDIT_CARD_BATCH_SIZE = 10  # Edit preview cards built per scroll step
+IO_POLL_MS = 50  # Status bar refresh while a file is read or written
+GENAI_IMPORT_POLL_MS = 50  # Startup check for the background SDK import
+EXECUTION_POLL_MS = 50  # Results window refresh while a script is running
+PIP_POLL_MIN_MS = 20  # Bootstrap pip output polling, backing off while idle
+PIP_POLL_MAX_MS = 500
+
+# Instructions and response format sent ahead of the code in every AI request
+AI_EDIT_INSTRUCTIONS = """You are a precise code editor assistant. Analyze the provided code and suggest specific edits based on the user's request.
+
+ALWAYS respond with valid JSON in this exact format:
+{
+  "analysis": "Brief summary of what you found and will change",
+  "edits": [
+    {
+      "line_start": 5,
+      "line_end": 5,
+      "original_code": "def old_function():",
+      "suggested_code": "def improved_function() -> None:",
+      "explanation": "Added type hint for better code documentation",
+      "edit_type": "replace",
+      "confidence": 0.95
+    }
+  ]
+}
+
+Rules:
+- Be surgical - only change what's necessary
+- Line numbers start from 1
+- For insertions: line_start = line_end, original_code = ""
+- For deletions: suggested_code = ""
+- Match original code exactly (including whitespace)
+- Focus on the specific user request
+- Only suggest changes that directly address the request"""
+
+# Extracts the payload of a ```json ... ``` fenced block in AI responses
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.DOTALL)
+
+# pip output lines that mark progress through a bootstrap install
+_PIP_PROGRESS_RE = re.compile(
+    r'^\s*(Collecting|Downloading|Using cached|Installing collected packages|Successfully installed)\s*(\S*)'
+)
+
+def _lazy_genai():
+    """Import the Gemini SDK on first use and cache it; returns None if unavailable"""
+    global genai, GENAI_AVAILABLE
+    if genai is None and GENAI_AVAILABLE:
+        try:
+            from google import genai as genai_module
+        except ImportError:
+            GENAI_AVAILABLE = False
+        else:
+            genai = genai_module
+    return genai
+
+def _load_saved_api_key():
+    """Return the API key stored in the OS keyring, or None"""
+    if not KEYRING_AVAILABLE:
+        return None
+    try:
+        import keyring
+        return keyring.get_password(KEYRING_SERVICE, KEYRING_USERNAME)
+    except Exception:  # No usable keyring backend on this system
+        return None
+
+def _save_api_key(api_key):
+    """Store the API key in the OS keyring; failures are ignored"""
+    if not KEYRING_AVAILABLE:
+        return
+    try:
+        import keyring
+        keyring.set_password(KEYRING_SERVICE, KEYRING_USERNAME, api_key)
+    except Exception:
+        pass
+
+def _select_ai_context(code, cursor_line):
+    """Choose the code sent to the AI for a request.
+    
+    Large files are narrowed to the top-level function or class containing
+    the cursor, plus an outline of the other top-level definitions. Returns
+    (code_excerpt, line_offset, outline); line_offset must be added to the
+    line numbers of the AI's edits, and outline is None when the whole file
+    is sent.
+    """
+    if code.count('\n') + 1 < AI_CONTEXT_MIN_LINES:
+        return code, 0, None
+        
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code, 0, None  # Mid-edit code that doesn't parse is sent whole
+        
+    outline = []
+    window = None
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        kind = "class" if isinstance(node, ast.ClassDef) else "def"
+        outline.append(f"- {kind} {node.name} (lines {start}-{node.end_lineno})")
+        if start <= cursor_line <= node.end_lineno:
+            window = (start, node.end_lineno)
+            
+    if window is None:
+        return code, 0, None
+        
+    # Split only up to the window; everything after it stays in one piece
+    start, end = window
+    lines = code.split('\n', end)
+    return '\n'.join(lines[start - 1:end]), start - 1, '\n'.join(outline)
+
+def _read_text_file(file_path, on_progress):
+    """Read a UTF-8 text file in chunks, reporting the fraction read so far"""
+    total_size = os.path.getsize(file_path) or 1
+    chunks = []
+    with open(file_path, 'r', encoding='utf-8') as file:
+        while True:
+            chunk = file.read(FILE_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            on_progress(min(file.buffer.tell() / total_size, 1.0))
+    return ''.join(chunks)
+
+def _write_text_file(file_path, content, on_progress):
+    """Write text to a UTF-8 file in chunks, reporting the fraction written so far"""
+    total_size = len(content) or 1
+    with open(file_path, 'w', encoding='utf-8') as file:
+        for offset in range(0, len(content), FILE_WRITE_CHUNK_SIZE):
+            file.write(content[offset:offset + FILE_WRITE_CHUNK_SIZE])
+            on_progress(min((offset + FILE_WRITE_CHUNK_SIZE) / total_size, 1.0))
+
+# Slotted dataclasses need Python 3.10+; older versions keep a per-instance __dict__
+_DATACLASS_OPTIONS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+EditType = Literal['replace', 'insert', 'delete']
+EDIT_TYPES = get_args(EditType)
+
+@dataclass(**_DATACLASS_OPTIONS)
 class EditSuggestion:
     """Represents a single edit suggestion from the AI"""
     line_start: int
@@ -43,9 +203,94 @@ class EditSuggestion:
     original_code: str
     suggested_code: str
     explanation: str
-    edit_type: str  # 'replace', 'insert', 'delete'
+    edit_type: EditType  # msgspec rejects any other value while decoding
     confidence: float
     selected: bool = True
+    # Set by __post_init__
+    original_line_count: int = field(default=0, init=False, repr=False, compare=False)
+    suggested_line_count: int = field(default=0, init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Line counts for sizing the preview; msgspec runs this on decode too
+        self.original_line_count = self.original_code.count('\n') + 1
+        self.suggested_line_count = self.suggested_code.count('\n') + 1
+
+@dataclass(**_DATACLASS_OPTIONS)
+class AIEditResponse:
+    """The JSON document the AI is asked to return"""
+    analysis: str
+    edits: List[EditSuggestion]
+
+_ai_response_decoder = None
+
+def _get_ai_response_decoder():
+    """Build the msgspec decoder on first use; it decodes and validates straight
+    into the dataclasses above in one C pass"""
+    global _ai_response_decoder
+    if _ai_response_decoder is None:
+        import msgspec
+        _ai_response_decoder = msgspec.json.Decoder(AIEditResponse)
+    return _ai_response_decoder
+
+def _parse_ai_response(payload):
+    """Decode the AI's JSON payload into an AIEditResponse.
+    
+    Raises json.JSONDecodeError for malformed JSON and KeyError/ValueError
+    when the document doesn't match the expected structure.
+    """
+    if MSGSPEC_AVAILABLE:
+        import msgspec
+        try:
+            ai_response = _get_ai_response_decoder().decode(payload)
+        except msgspec.ValidationError:
+            raise  # A ValueError: valid JSON with the wrong structure
+        except msgspec.DecodeError:
+            json.loads(payload)  # Re-parse to raise a JSONDecodeError with position info
+            raise
+    else:
+        if ORJSON_AVAILABLE:
+            import orjson
+            ai_data = orjson.loads(payload)  # orjson.JSONDecodeError subclasses json.JSONDecodeError
+        else:
+            ai_data = json.loads(payload)
+        
+        # Validate response structure
+        if 'analysis' not in ai_data or 'edits' not in ai_data:
+            raise ValueError("Invalid AI response structure")
+            
+        ai_response = AIEditResponse(
+            analysis=ai_data['analysis'],
+            edits=[
+                EditSuggestion(
+                    line_start=edit_data['line_start'],
+                    line_end=edit_data['line_end'],
+                    original_code=edit_data['original_code'],
+                    suggested_code=edit_data['suggested_code'],
+                    explanation=edit_data['explanation'],
+                    edit_type=edit_data['edit_type'],
+                    confidence=edit_data['confidence']
+                )
+                for edit_data in ai_data['edits']
+            ]
+        )
+        for edit in ai_response.edits:
+            if edit.edit_type not in EDIT_TYPES:
+                raise ValueError(f"Invalid edit_type: {edit.edit_type!r}")
+                
+    _share_duplicate_code(ai_response.edits)
+    return ai_response
+
+def _share_duplicate_code(edits):
+    """Make edits with identical code snippets share a single string object.
+    
+    edit_type is interned as well, so comparing it with the 'replace',
+    'insert' and 'delete' literals usually succeeds on identity.
+    """
+    pool = {}
+    for edit in edits:
+        edit.original_code = pool.setdefault(edit.original_code, edit.original_code)
+        edit.suggested_code = pool.setdefault(edit.suggested_code, edit.suggested_code)
+        edit.edit_type = sys.intern(edit.edit_type)
 
 class ModernStyle:
     """Modern dark theme styling constants"""
@@ -79,16 +324,26 @@ class AICodeEditor:
         self.root = tk.Tk()
         self.setup_window()
         self.setup_variables()
+        self.apply_modern_styling()  # Styles must exist before widgets use them
         self.setup_ui()
         self.setup_bindings()
-        self.apply_modern_styling()
         
         # Load sample code
         self.load_sample_code()
         
-        # Initialize AI
-        self.setup_gemini()
+        # Import the SDK in the background and initialize AI once it is done,
+        # so the Tk thread never waits on the import lock
+        genai_import = threading.Thread(target=_lazy_genai, name="genai-import", daemon=True)
+        genai_import.start()
+        self.root.after(GENAI_IMPORT_POLL_MS, self._setup_gemini_when_imported, genai_import)
         
+    def _setup_gemini_when_imported(self, genai_import):
+        """Poll until the background SDK import finishes, then initialize AI"""
+        if genai_import.is_alive():
+            self.root.after(GENAI_IMPORT_POLL_MS, self._setup_gemini_when_imported, genai_import)
+        else:
+            self.setup_gemini()
+            
     def setup_window(self):
         """Configure the main window"""
         self.root.title("AI Code Editor - Gemini Integration")
@@ -104,19 +359,41 @@ class AICodeEditor:
         """Initialize instance variables"""
         self.current_file = None
         self.is_modified = False
-        self.gemini_model = None
+        self.gemini_client = None
         self.api_key = None
+        self._configured_key = None  # Key the current gemini_client was created with
         self.pending_edits = []
         self.is_ai_processing = False
+        self._ai_cache = OrderedDict()  # blake2b(prompt, code) -> AI JSON payload
+        self._last_title = ""
+        self._edit_generation = 0  # Bumped on every buffer change
+        self._text_cache = None  # (generation, text) of the last full buffer read
+        # A single worker runs file operations in submission order, so saves
+        # and opens of the same file never overlap
+        self._io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-io")
+        self._io_jobs = deque()  # (future, on_done) in submission order, finished by the Tk poll
+        self._io_progress = deque()  # (message, fraction) appended by the I/O worker
+        self._io_poll_job = None
+        
+        # One long-lived event loop runs every AI request so the async Gemini
+        # client can reuse its connection pool between requests; it is started
+        # by the first request
+        self._ai_loop = None
+        self._results_window = None  # Built on the first run, then reused
+        self._execution_run = 0  # Bumped per run so late output from an old run is dropped
+        self._line_numbers_job = None
         
     def setup_gemini(self):
         """Initialize Gemini AI integration"""
-        if not GENAI_AVAILABLE:
-            self.ai_status_label.config(text="AI: Not Available (Install google-generativeai)")
+        if _lazy_genai() is None:
+            self.ai_status_label.config(text="AI: Not Available (Install google-genai)")
             return
             
-        # Try to load API key from environment or prompt user
-        self.api_key = os.getenv('GEMINI_API_KEY')
+        # Use a key set via the Settings menu, then the environment, then the
+        # OS keyring, and only prompt the user as a last resort
+        prompted = False
+        if not self.api_key:
+            self.api_key = os.getenv('GEMINI_API_KEY') or _load_saved_api_key()
         if not self.api_key:
             self.api_key = simpledialog.askstring(
                 "Gemini API Key", 
@@ -124,11 +401,16 @@ class AICodeEditor:
                 show='*',
                 parent=self.root 
             )
+            prompted = True
             
         if self.api_key:
+            if self.gemini_client is not None and self._configured_key == self.api_key:
+                return  # Already connected with this key
             try:
-                genai.configure(api_key=self.api_key)
-                self.gemini_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+                self.gemini_client = genai.Client(api_key=self.api_key)
+                self._configured_key = self.api_key
+                if prompted:
+                    _save_api_key(self.api_key)
                 self.ai_status_label.config(
                     text="AI: Connected ✓", 
                     foreground=ModernStyle.ACCENT_GREEN
@@ -186,25 +468,16 @@ class AICodeEditor:
         toolbar_frame.grid(row=0, column=0, sticky="ew", padx=5, pady=2)
         toolbar_frame.grid_propagate(False)
         
-        # Buttons with modern styling
-        btn_style = {
-            'bg': ModernStyle.BG_HOVER,
-            'fg': ModernStyle.TEXT_PRIMARY,
-            'font': ModernStyle.FONT_MAIN,
-            'relief': 'flat',
-            'borderwidth': 0,
-            'padx': 15,
-            'pady': 5
-        }
-        
-        tk.Button(toolbar_frame, text="📄 New", command=self.new_file, **btn_style).pack(side=tk.LEFT, padx=2)
-        tk.Button(toolbar_frame, text="📁 Open", command=self.open_file, **btn_style).pack(side=tk.LEFT, padx=2)
-        tk.Button(toolbar_frame, text="💾 Save", command=self.save_file, **btn_style).pack(side=tk.LEFT, padx=2)
+        # Buttons share the 'Toolbar.TButton' style registered in apply_modern_styling.
+        # Labels stick to glyphs in the UI font; emoji force a font fallback lookup on every redraw.
+        ttk.Button(toolbar_frame, text="+ New", command=self.new_file, style='Toolbar.TButton').pack(side=tk.LEFT, padx=2)
+        ttk.Button(toolbar_frame, text="Open", command=self.open_file, style='Toolbar.TButton').pack(side=tk.LEFT, padx=2)
+        ttk.Button(toolbar_frame, text="Save", command=self.save_file, style='Toolbar.TButton').pack(side=tk.LEFT, padx=2)
         
         # Separator
         tk.Frame(toolbar_frame, width=2, bg=ModernStyle.TEXT_TERTIARY).pack(side=tk.LEFT, fill=tk.Y, padx=10, pady=5)
         
-        tk.Button(toolbar_frame, text="▶️ Run", command=self.run_code, **btn_style).pack(side=tk.LEFT, padx=2)
+        ttk.Button(toolbar_frame, text="▶ Run", command=self.run_code, style='Toolbar.TButton').pack(side=tk.LEFT, padx=2)
         
         # AI Status on the right
         self.ai_status_label = tk.Label(
@@ -249,7 +522,7 @@ class AICodeEditor:
         # Ask AI Button
         self.ask_ai_btn = tk.Button(
             ai_frame,
-            text="🤖 Ask AI",
+            text="Ask AI",
             command=self.ask_ai,
             bg=ModernStyle.ACCENT_BLUE,
             fg=ModernStyle.TEXT_PRIMARY,
@@ -268,18 +541,14 @@ class AICodeEditor:
         editor_frame.grid_rowconfigure(0, weight=1)
         editor_frame.grid_columnconfigure(1, weight=1)
         
-        # Line numbers
-        self.line_numbers = tk.Text(
+        # Line numbers, drawn on a canvas for the visible lines only
+        self._gutter_digit_width = tkfont.Font(font=ModernStyle.FONT_CODE).measure('0')
+        self.line_numbers = tk.Canvas(
             editor_frame,
-            width=4,
-            padx=5,
-            pady=5,
+            width=self._gutter_digit_width * 4 + 10,
             bg=ModernStyle.BG_PANEL,
-            fg=ModernStyle.TEXT_TERTIARY,
-            font=ModernStyle.FONT_CODE,
-            relief='flat',
-            state='disabled',
-            wrap='none'
+            highlightthickness=0,
+            borderwidth=0
         )
         self.line_numbers.grid(row=0, column=0, sticky="ns")
         
@@ -301,16 +570,15 @@ class AICodeEditor:
         # Scrollbars
         v_scrollbar = tk.Scrollbar(editor_frame, orient="vertical", command=self.on_scroll)
         v_scrollbar.grid(row=0, column=2, sticky="ns")
-        self.code_text.config(yscrollcommand=v_scrollbar.set)
+        self.code_text.config(yscrollcommand=lambda first, last: self.on_code_yview(v_scrollbar, first, last))
         
         h_scrollbar = tk.Scrollbar(editor_frame, orient="horizontal", command=self.code_text.xview)
         h_scrollbar.grid(row=1, column=1, sticky="ew")
         self.code_text.config(xscrollcommand=h_scrollbar.set)
         
         # Bind events
-        self.code_text.bind('<KeyRelease>', self.on_text_change)
-        self.code_text.bind('<Button-1>', self.on_text_change)
-        self.code_text.bind('<Return>', self.on_text_change)
+        self.code_text.bind('<<Modified>>', self._on_modified)
+        self.code_text.bind('<Configure>', lambda e: self.schedule_line_numbers_update())
         
     def create_status_bar(self):
         """Create the status bar"""
@@ -333,7 +601,7 @@ class AICodeEditor:
         self.root.bind('<Control-s>', lambda e: self.save_file())
         self.root.bind('<Control-Shift-S>', lambda e: self.save_file_as())
         self.root.bind('<F5>', lambda e: self.run_code())
-        self.root.bind('<Return>', self.on_enter_pressed)
+        self.ai_prompt_entry.bind('<Return>', self.on_enter_pressed)
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
     def apply_modern_styling(self):
@@ -348,6 +616,25 @@ class AICodeEditor:
                        borderwidth=0,
                        focuscolor='none')
         
+        style.configure('Toolbar.TButton',
+                       background=ModernStyle.BG_HOVER,
+                       foreground=ModernStyle.TEXT_PRIMARY,
+                       font=ModernStyle.FONT_MAIN,
+                       borderwidth=0,
+                       relief='flat',
+                       focuscolor='none',
+                       padding=(15, 5))
+        style.map('Toolbar.TButton',
+                  background=[('active', ModernStyle.BG_SELECTED)])
+        
+        # Option database defaults for the diff boxes in edit cards, so each
+        # card's Text widgets are created with just a name
+        for name, background in (('removedCode', '#2d1b1b'), ('addedCode', '#1b2d1b')):
+            self.root.option_add(f'*{name}.background', background)
+            self.root.option_add(f'*{name}.foreground', ModernStyle.TEXT_PRIMARY)
+            self.root.option_add(f'*{name}.font', ModernStyle.FONT_CODE)
+            self.root.option_add(f'*{name}.wrap', tk.NONE)
+        
     def load_sample_code(self):
         """Load sample Python code with various issues for testing"""
         sample_code = '''import sys
@@ -400,30 +687,95 @@ if __name__ == "__main__":
     avg = calculate_average(numbers)
     print(f"Average: {avg}")
 '''
-        self.code_text.insert('1.0', sample_code)
-        self.update_line_numbers()
+        self._set_editor_text(sample_code)
+        self.schedule_line_numbers_update(idle=True)
         
     def on_scroll(self, *args):
-        """Handle scrolling for synchronized line numbers"""
+        """Handle the vertical scrollbar; line numbers follow via on_code_yview"""
         self.code_text.yview(*args)
-        self.line_numbers.yview(*args)
+        
+    def on_code_yview(self, scrollbar, first, last):
+        """Keep the scrollbar and line numbers in step with the editor's view"""
+        scrollbar.set(first, last)
+        self.schedule_line_numbers_update(idle=True)
+        
+    def _on_modified(self, event=None):
+        """Handle Tk's <<Modified>> virtual event, fired once per buffer change
+        
+        Also called directly to account for a change whose event is still queued.
+        """
+        if not self.code_text.edit_modified():
+            return
+        # Reset the flag so the next change fires the event again
+        self.code_text.edit_modified(False)
+        self._edit_generation += 1
+        self.on_text_change()
+        
+    def _set_editor_text(self, content):
+        """Replace the whole buffer without flagging it as modified by the user"""
+        self.code_text.delete('1.0', 'end')
+        self.code_text.insert('1.0', content)
+        self.code_text.edit_modified(False)
+        self._edit_generation += 1
+        self._text_cache = (self._edit_generation, content)
+        
+    def _full_text(self):
+        """Return the buffer contents, reusing the last copy if nothing changed since"""
+        # Tk sets the modified flag at once but queues <<Modified>>, so a key
+        # event handled before it (Ctrl+S, F5) must account for the change here
+        self._on_modified()
+        if self._text_cache is None or self._text_cache[0] != self._edit_generation:
+            self._text_cache = (self._edit_generation, self.code_text.get('1.0', 'end-1c'))
+        return self._text_cache[1]
         
     def on_text_change(self, event=None):
         """Handle text changes in the editor"""
-        self.update_line_numbers()
+        self.schedule_line_numbers_update()
         self.is_modified = True
         self.update_title()
         
+    def schedule_line_numbers_update(self, idle=False):
+        """Coalesce rapid edits into a single line number refresh
+        
+        Typing is debounced by 50ms; with idle=True the refresh runs as soon as
+        the event loop is idle, unless one is already pending.
+        """
+        if idle:
+            if self._line_numbers_job is None:
+                self._line_numbers_job = self.root.after_idle(self.update_line_numbers)
+            return
+        if self._line_numbers_job is not None:
+            self.root.after_cancel(self._line_numbers_job)
+        self._line_numbers_job = self.root.after(50, self.update_line_numbers)
+        
     def update_line_numbers(self):
-        """Update the line numbers display"""
-        self.line_numbers.config(state='normal')
-        self.line_numbers.delete('1.0', 'end')
+        """Redraw the line numbers for the lines currently visible in the editor"""
+        self._line_numbers_job = None
+        gutter = self.line_numbers
+        gutter.delete('all')
         
+        # Widen the gutter when the line count gains a digit
         line_count = int(self.code_text.index('end-1c').split('.')[0])
-        line_numbers_text = '\n'.join(str(i) for i in range(1, line_count + 1))
-        
-        self.line_numbers.insert('1.0', line_numbers_text)
-        self.line_numbers.config(state='disabled')
+        width = self._gutter_digit_width * max(4, len(str(line_count))) + 10
+        if int(gutter.cget('width')) != width:
+            gutter.config(width=width)
+            
+        index = self.code_text.index('@0,0')
+        while True:
+            dline = self.code_text.dlineinfo(index)
+            if dline is None:  # Below the visible area (or not mapped yet)
+                break
+            gutter.create_text(
+                width - 5, dline[1],
+                anchor='ne',
+                text=index.split('.')[0],
+                fill=ModernStyle.TEXT_TERTIARY,
+                font=ModernStyle.FONT_CODE
+            )
+            next_index = self.code_text.index(f"{index}+1line")
+            if next_index == index:  # Last line
+                break
+            index = next_index
         
     def update_title(self):
         """Update the window title"""
@@ -432,18 +784,21 @@ if __name__ == "__main__":
             title += f" - {os.path.basename(self.current_file)}"
         if self.is_modified:
             title += " *"
-        self.root.title(title)
+        # Only hit the window manager when the title actually changes
+        if title != self._last_title:
+            self.root.title(title)
+            self._last_title = title
         
     def new_file(self):
         """Create a new file"""
         if self.is_modified and not self.confirm_unsaved_changes():
             return
             
-        self.code_text.delete('1.0', 'end')
+        self._set_editor_text('')
         self.current_file = None
         self.is_modified = False
         self.update_title()
-        self.update_line_numbers()
+        self.schedule_line_numbers_update(idle=True)
         self.status_bar.config(text="New file created")
         
     def open_file(self):
@@ -460,29 +815,78 @@ if __name__ == "__main__":
         )
         
         if file_path:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    
-                self.code_text.delete('1.0', 'end')
-                self.code_text.insert('1.0', content)
-                self.current_file = file_path
-                self.is_modified = False
-                self.update_title()
-                self.update_line_numbers()
-                self.status_bar.config(text=f"Opened: {os.path.basename(file_path)}")
-                
-            except Exception as e:
-                messagebox.showerror("Error", f"Could not open file: {str(e)}", parent=self.root)
-                
-    def save_file(self):
+            # Read on the I/O worker so large files don't freeze the UI
+            progress_message = f"Opening {os.path.basename(file_path)}"
+            self.status_bar.config(text=f"{progress_message}...")
+            self._submit_io(
+                lambda f: self._finish_open_file(file_path, f),
+                progress_message, _read_text_file, file_path
+            )
+            
+    def _finish_open_file(self, file_path, future):
+        """Load the text read by the I/O worker into the editor"""
+        try:
+            content = future.result()
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not open file: {str(e)}", parent=self.root)
+            self.status_bar.config(text="Ready")
+            return
+            
+        self._set_editor_text(content)
+        self.current_file = file_path
+        self.is_modified = False
+        self.update_title()
+        self.schedule_line_numbers_update(idle=True)
+        self.status_bar.config(text=f"Opened: {os.path.basename(file_path)}")
+        
+    def _submit_io(self, on_done, progress_message, func, *args):
+        """Run func(*args, on_progress) on the I/O worker; on_done(future) runs on the Tk thread
+        
+        The worker never calls into Tk: progress and completion are picked up
+        by _drain_io_events.
+        """
+        progress = self._io_progress
+        future = self._io_pool.submit(
+            func, *args,
+            lambda fraction: progress.append((progress_message, fraction))
+        )
+        self._io_jobs.append((future, on_done))
+        if self._io_poll_job is None:
+            self._io_poll_job = self.root.after(IO_POLL_MS, self._drain_io_events)
+            
+    def _drain_io_events(self):
+        """Show the latest I/O progress and finish completed jobs in order"""
+        self._io_poll_job = None
+        if self._io_progress:
+            message, fraction = self._io_progress[-1]
+            self._io_progress.clear()
+            self.status_bar.config(text=f"{message}... {fraction:.0%}")
+            
+        while self._io_jobs and self._io_jobs[0][0].done():
+            future, on_done = self._io_jobs.popleft()
+            on_done(future)
+            
+        if self._io_jobs:
+            self._io_poll_job = self.root.after(IO_POLL_MS, self._drain_io_events)
+        else:
+            self._io_progress.clear()  # Leftovers belong to jobs already finished
+            
+    def _finish_pending_io(self):
+        """Block until every queued file operation is done and finish each in order"""
+        while self._io_jobs:
+            future, on_done = self._io_jobs.popleft()
+            future.exception()  # Waits without raising
+            on_done(future)
+        self._io_progress.clear()
+        
+    def save_file(self, wait=False):
         """Save the current file"""
         if self.current_file:
-            self.save_to_file(self.current_file)
+            self.save_to_file(self.current_file, wait)
         else:
-            self.save_file_as()
+            self.save_file_as(wait)
             
-    def save_file_as(self):
+    def save_file_as(self, wait=False):
         """Save the file with a new name"""
         file_path = filedialog.asksaveasfilename(
             title="Save File",
@@ -494,22 +898,45 @@ if __name__ == "__main__":
         )
         
         if file_path:
-            self.save_to_file(file_path)
+            self.save_to_file(file_path, wait)
             
-    def save_to_file(self, file_path):
-        """Save content to the specified file"""
-        try:
-            with open(file_path, 'w', encoding='utf-8') as file:
-                content = self.code_text.get('1.0', 'end-1c')
-                file.write(content)
-                
-            self.current_file = file_path
-            self.is_modified = False
-            self.update_title()
-            self.status_bar.config(text=f"Saved: {os.path.basename(file_path)}")
+    def save_to_file(self, file_path, wait=False):
+        """Save content to the specified file on the I/O worker.
+        
+        With wait=True any queued file operations are finished first and the file
+        is then written on the Tk thread, for callers that need the result
+        immediately (closing, running the file).
+        """
+        content = self._full_text()
+        generation = self._edit_generation
+        if wait:
+            self._finish_pending_io()  # A background save of the same file must not race this one
+            try:
+                _write_text_file(file_path, content, lambda fraction: None)
+            except Exception as e:
+                self._finish_save_file(file_path, generation, e)
+            else:
+                self._finish_save_file(file_path, generation, None)
+            return
             
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not save file: {str(e)}", parent=self.root)
+        progress_message = f"Saving {os.path.basename(file_path)}"
+        self.status_bar.config(text=f"{progress_message}...")
+        self._submit_io(
+            lambda f: self._finish_save_file(file_path, generation, f.exception()),
+            progress_message, _write_text_file, file_path, content
+        )
+            
+    def _finish_save_file(self, file_path, generation, error):
+        """Update editor state once the file has been written"""
+        if error is not None:
+            messagebox.showerror("Error", f"Could not save file: {str(error)}", parent=self.root)
+            return
+            
+        self.current_file = file_path
+        # Edits typed while the save was in flight keep the buffer modified
+        self.is_modified = self._edit_generation != generation
+        self.update_title()
+        self.status_bar.config(text=f"Saved: {os.path.basename(file_path)}")
             
     def confirm_unsaved_changes(self):
         """Ask user about unsaved changes"""
@@ -520,7 +947,7 @@ if __name__ == "__main__":
         )
         
         if result is True:  # Yes, save
-            self.save_file()
+            self.save_file(wait=True)
             return not self.is_modified  # Only proceed if save was successful
         elif result is False:  # No, don't save
             return True
@@ -529,49 +956,135 @@ if __name__ == "__main__":
             
     def run_code(self):
         """Execute the current Python code"""
+        self._on_modified()  # Count a keystroke whose <<Modified>> is still queued
         if not self.current_file:
             # Save to temporary file
             temp_file = "temp_code.py"
             with open(temp_file, 'w', encoding='utf-8') as f:
-                f.write(self.code_text.get('1.0', 'end-1c'))
+                f.write(self._full_text())
             file_to_run = temp_file
         else:
             if self.is_modified:
-                self.save_file()
+                self.save_file(wait=True)
             file_to_run = self.current_file
             
-        # Run in separate thread to prevent UI blocking
-        threading.Thread(target=self._execute_code, args=(file_to_run,), daemon=True).start()
+        # Open the results window up-front so output can stream into it
+        self.show_execution_results()
+        
+        # Run in separate thread to prevent UI blocking; the Tk loop drains
+        # its output in batches
+        run = self._execution_run
+        # deque.append/popleft are atomic, so the worker threads and the Tk
+        # poll can share it without locking
+        output = deque()
+        self.status_bar.config(text="Running code...")
+        threading.Thread(target=self._execute_code, args=(file_to_run, output), daemon=True).start()
+        self.root.after(EXECUTION_POLL_MS, self._drain_execution_output, run, output)
+        
+    def _execute_code(self, file_path, output):
+        """Execute code in a separate thread, queueing its output as it arrives
+        
+        Output lines are queued as ('stdout' | 'stderr', line); the last entry
+        is ('exit', (returncode, seconds)), ('timeout', None) or ('error', message).
+        """
+        import subprocess
         
-    def _execute_code(self, file_path):
-        """Execute code in a separate thread"""
         try:
-            self.status_bar.config(text="Running code...")
-            start_time = time.time()
+            start_time = time.perf_counter()
             
-            result = subprocess.run(
-                [sys.executable, file_path],
-                capture_output=True,
+            # -u keeps the child's stdout unbuffered so lines arrive as they are printed
+            process = subprocess.Popen(
+                [sys.executable, '-u', file_path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 text=True,
-                timeout=30
+                bufsize=1
             )
+            readers = [
+                threading.Thread(target=self._stream_output, args=(process.stdout, output, 'stdout'), daemon=True),
+                threading.Thread(target=self._stream_output, args=(process.stderr, output, 'stderr'), daemon=True)
+            ]
+            for reader in readers:
+                reader.start()
+                
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+                for reader in readers:
+                    reader.join()
+                output.append(('timeout', None))
+                return
+                
+            for reader in readers:
+                reader.join()
+            execution_time = time.perf_counter() - start_time
             
-            execution_time = time.time() - start_time
-            
-            # Show results in a popup window
-            self.root.after(0, self.show_execution_results, result, execution_time)
+            output.append(('exit', (process.returncode, execution_time)))
             
-        except subprocess.TimeoutExpired:
-            self.root.after(0, lambda: self.status_bar.config(text="Code execution timed out"))
         except Exception as e:
-            self.root.after(0, lambda: self.status_bar.config(text=f"Execution error: {str(e)}"))
+            output.append(('error', f"Execution error: {str(e)}"))
+            
+    def _stream_output(self, stream, output, channel):
+        """Queue a child process stream for the results window line by line"""
+        with stream:
+            for line in stream:
+                output.append((channel, line))
+                
+    def _drain_execution_output(self, run, output):
+        """Move queued output into the results window, polling until the run ends"""
+        if run != self._execution_run:
+            return  # A newer run has replaced this one
             
-    def show_execution_results(self, result, execution_time):
-        """Show code execution results in a popup"""
+        # Join everything queued since the last poll so each tab gets one insert
+        texts = {'stdout': [], 'stderr': []}
+        outcome = None
+        while output:
+            channel, value = output.popleft()
+            if channel in texts:
+                texts[channel].append(value)
+            else:
+                outcome = (channel, value)
+        for channel, lines in texts.items():
+            if lines:
+                self._append_execution_output(''.join(lines), channel)
+                
+        if outcome is None:
+            self.root.after(EXECUTION_POLL_MS, self._drain_execution_output, run, output)
+        elif outcome[0] == 'exit':
+            self._finish_execution_results(*outcome[1])
+        elif outcome[0] == 'timeout':
+            self.status_bar.config(text="Code execution timed out")
+        else:
+            self.status_bar.config(text=outcome[1])
+                
+    def show_execution_results(self):
+        """Show the code execution results popup, ready to receive streamed output
+        
+        The window is built once per session; later runs clear and re-show it.
+        """
+        self._execution_run += 1
+        if self._results_window is None:
+            self._build_results_window()
+        else:
+            self._output_text.delete('1.0', 'end')
+            self._error_text.delete('1.0', 'end')
+            self._results_notebook.hide(self._error_frame)
+            self._results_notebook.select(0)
+            self._results_window.deiconify()
+            self._results_window.lift()
+        self._has_stdout = False
+        self._has_stderr = False
+        
+    def _build_results_window(self):
+        """Create the results popup and its Output and (hidden) Errors tabs"""
         results_window = tk.Toplevel(self.root)
         results_window.title("Code Execution Results")
         results_window.geometry("600x400")
         results_window.configure(bg=ModernStyle.BG_MAIN)
+        # Closing only hides the window so the next run can reuse it
+        results_window.protocol("WM_DELETE_WINDOW", results_window.withdraw)
         
         # Create notebook for tabs
         notebook = ttk.Notebook(results_window)
@@ -589,30 +1102,53 @@ if __name__ == "__main__":
             wrap=tk.WORD
         )
         output_text.pack(fill=tk.BOTH, expand=True)
-        output_text.insert('1.0', result.stdout if result.stdout else "(No output)")
         
-        # Error tab (if there are errors)
-        if result.stderr:
-            error_frame = tk.Frame(notebook, bg=ModernStyle.BG_MAIN)
-            notebook.add(error_frame, text="Errors")
+        # Errors tab, shown only once the program writes to stderr
+        error_frame = tk.Frame(notebook, bg=ModernStyle.BG_MAIN)
+        notebook.add(error_frame, text="Errors")
+        notebook.hide(error_frame)
+        
+        error_text = tk.Text(
+            error_frame,
+            bg=ModernStyle.BG_MAIN,
+            fg=ModernStyle.ACCENT_RED,
+            font=ModernStyle.FONT_CODE,
+            wrap=tk.WORD
+        )
+        error_text.pack(fill=tk.BOTH, expand=True)
+        
+        self._results_window = results_window
+        self._results_notebook = notebook
+        self._output_text = output_text
+        self._error_frame = error_frame
+        self._error_text = error_text
+        
+    def _append_execution_output(self, text, channel):
+        """Append streamed output to the Output or Errors tab"""
+        if channel == 'stdout':
+            self._has_stdout = True
+            self._output_text.insert('end', text)
+            self._output_text.see('end')
+            return
             
-            error_text = tk.Text(
-                error_frame,
-                bg=ModernStyle.BG_MAIN,
-                fg=ModernStyle.ACCENT_RED,
-                font=ModernStyle.FONT_CODE,
-                wrap=tk.WORD
-            )
-            error_text.pack(fill=tk.BOTH, expand=True)
-            error_text.insert('1.0', result.stderr)
+        if not self._has_stderr:
+            self._has_stderr = True
+            self._results_notebook.add(self._error_frame)  # Un-hides the tab
+        self._error_text.insert('end', text)
+        self._error_text.see('end')
+        
+    def _finish_execution_results(self, returncode, execution_time):
+        """Finalize the results window once the process has exited"""
+        if not self._has_stdout:
+            self._output_text.insert('1.0', "(No output)")
             
         # Status info
-        status_text = f"Exit code: {result.returncode} | Execution time: {execution_time:.2f}s"
+        status_text = f"Exit code: {returncode} | Execution time: {execution_time:.2f}s"
         self.status_bar.config(text=status_text)
         
     def ask_ai(self):
         """Send prompt to AI and get edit suggestions"""
-        if not self.gemini_model:
+        if not self.gemini_client:
             messagebox.showerror("Error", "AI model not available. Please configure your API key.", parent=self.root)
             return
             
@@ -622,179 +1158,230 @@ if __name__ == "__main__":
             return
             
         # Disable AI button and show processing
-        self.ask_ai_btn.config(state='disabled', text="🤖 Processing...")
+        self.ask_ai_btn.config(state='disabled', text="Processing...")
         self.is_ai_processing = True
         
-        # Run AI request in separate thread
-        threading.Thread(target=self._process_ai_request, args=(prompt,), daemon=True).start()
+        import asyncio
         
-    def _process_ai_request(self, prompt):
-        """Process AI request in separate thread"""
+        # Run AI request on the AI event loop thread
+        # The buffer is read here on the Tk thread; the coroutine only sees the copy
+        cursor_line = int(self.code_text.index('insert').split('.')[0])
+        asyncio.run_coroutine_threadsafe(
+            self._process_ai_request(prompt, self._full_text(), cursor_line),
+            self._get_ai_loop()
+        )
+        
+    def _get_ai_loop(self):
+        """Return the AI event loop, starting its thread on first use"""
+        if self._ai_loop is None:
+            import asyncio
+            self._ai_loop = asyncio.new_event_loop()
+            threading.Thread(target=self._ai_loop.run_forever, name="ai-loop", daemon=True).start()
+        return self._ai_loop
+        
+    async def _process_ai_request(self, prompt, current_code, cursor_line):
+        """Process AI request on the AI event loop thread"""
+        # Outcome handed to the main thread in a single callback when done
+        preview = None  # (analysis, edit_suggestions)
+        error = None  # (dialog title, message)
+        status_message = None
         try:
-            current_code = self.code_text.get('1.0', 'end-1c')
-            
-            ai_prompt = f"""You are a precise code editor assistant. Analyze the provided code and suggest specific edits based on the user's request.
-
-ALWAYS respond with valid JSON in this exact format:
-{{
-  "analysis": "Brief summary of what you found and will change",
-  "edits": [
-    {{
-      "line_start": 5,
-      "line_end": 5,
-      "original_code": "def old_function():",
-      "suggested_code": "def improved_function() -> None:",
-      "explanation": "Added type hint for better code documentation",
-      "edit_type": "replace",
-      "confidence": 0.95
-    }}
-  ]
-}}
-
-Rules:
-- Be surgical - only change what's necessary
-- Line numbers start from 1
-- For insertions: line_start = line_end, original_code = ""
-- For deletions: suggested_code = ""
-- Match original code exactly (including whitespace)
-- Focus on the specific user request
-- Only suggest changes that directly address the request
+            code_for_ai, line_offset, outline = _select_ai_context(current_code, cursor_line)
+            if outline is None:
+                code_heading = "Current code:"
+            else:
+                code_heading = (
+                    "Top-level definitions in the file:\n"
+                    f"{outline}\n\n"
+                    "Current code (only the definition being edited is shown; number its lines from 1):"
+                )
+                
+            ai_prompt = f"""{AI_EDIT_INSTRUCTIONS}
 
-Current code:
+{code_heading}
 ```python
-{current_code}
+{code_for_ai}
 ```
 
 User request: {prompt}"""
 
-            response = self.gemini_model.generate_content(ai_prompt)
+            # Identical requests (same prompt, code and excerpt) are answered from the local cache
+            cache_key = hashlib.blake2b(
+                f"{line_offset}\0{ai_prompt}".encode('utf-8'),
+                digest_size=16
+            ).digest()
+            cached_payload = self._ai_cache.get(cache_key)
+            if cached_payload is not None:
+                self._ai_cache.move_to_end(cache_key)
+                # Decoding again yields fresh EditSuggestion objects for this preview
+                ai_response = _parse_ai_response(cached_payload)
+                self._shift_edit_lines(ai_response.edits, line_offset)
+                preview = (ai_response.analysis, ai_response.edits)
+                status_message = "AI suggestions ready for review (cached)."
+                return
+
+            # Stream the response; parsing starts once the stream closes.
+            # No identical request can be in flight: the Ask AI button is
+            # disabled and Enter is ignored while is_ai_processing is set.
+            raw_response = await self._stream_ai_response(ai_prompt)
             
             # Parse AI response
             try:
                 # Extract JSON from response
-                response_text = response.text.strip()
-                if response_text.startswith('```json'):
-                    response_text = response_text[7:-3]
-                elif response_text.startswith('```'):
-                    response_text = response_text[3:-3]
-                    
-                ai_data = json.loads(response_text)
+                fence_match = _FENCE_RE.match(raw_response)
+                response_text = fence_match.group(1) if fence_match else raw_response.strip()
                 
-                # Validate response structure
-                if 'analysis' not in ai_data or 'edits' not in ai_data:
-                    raise ValueError("Invalid AI response structure")
-                    
-                # Convert to EditSuggestion objects
-                edit_suggestions = []
-                for edit_data in ai_data['edits']:
-                    suggestion = EditSuggestion(
-                        line_start=edit_data['line_start'],
-                        line_end=edit_data['line_end'],
-                        original_code=edit_data['original_code'],
-                        suggested_code=edit_data['suggested_code'],
-                        explanation=edit_data['explanation'],
-                        edit_type=edit_data['edit_type'],
-                        confidence=edit_data['confidence']
-                    )
-                    edit_suggestions.append(suggestion)
+                # Decode and validate into EditSuggestion objects
+                ai_response = _parse_ai_response(response_text)
+                self._shift_edit_lines(ai_response.edits, line_offset)
+                
+                # Remember the valid payload, evicting the least recently used entry
+                self._ai_cache[cache_key] = response_text
+                if len(self._ai_cache) > AI_CACHE_SIZE:
+                    self._ai_cache.popitem(last=False)
                     
-                # Show edit preview on main thread
-                self.root.after(0, self.show_edit_preview, ai_data['analysis'], edit_suggestions)
-                self.root.after(0, lambda: self.status_bar.config(text="AI suggestions ready for review."))
+                preview = (ai_response.analysis, ai_response.edits)
+                status_message = "AI suggestions ready for review."
                 
             except json.JSONDecodeError as e:
                 error_message = f"Could not parse AI response (JSONDecodeError): {str(e)}\n"
                 error_message += f"Position: {e.pos}, Line: {e.lineno}, Column: {e.colno}\n"
-                error_message += f"\nRaw response excerpt:\n{response.text[:500]}..."
-                self.root.after(0, lambda: messagebox.showerror("AI Response Error", error_message, parent=self.root))
-                self.root.after(0, lambda: self.status_bar.config(text="AI Error: Invalid JSON response."))
+                error_message += f"\nRaw response excerpt:\n{raw_response[:500]}..."
+                error = ("AI Response Error", error_message)
+                status_message = "AI Error: Invalid JSON response."
             except (KeyError, ValueError) as e:
                 error_message = f"Invalid AI response structure ({type(e).__name__}): {str(e)}\n"
                 error_message += "\nThe AI response did not match the expected format (e.g., missing 'analysis' or 'edits' keys).\n"
-                error_message += f"\nRaw response excerpt:\n{response.text[:500]}..."
-                self.root.after(0, lambda: messagebox.showerror("AI Response Error", error_message, parent=self.root))
-                self.root.after(0, lambda: self.status_bar.config(text="AI Error: Unexpected response structure."))
+                error_message += f"\nRaw response excerpt:\n{raw_response[:500]}..."
+                error = ("AI Response Error", error_message)
+                status_message = "AI Error: Unexpected response structure."
                 
         except Exception as e:
-            # This catches errors from self.gemini_model.generate_content() or other unexpected issues
-            self.root.after(0, lambda: messagebox.showerror(
+            # This catches errors from the Gemini stream or other unexpected issues
+            error = (
                 "AI Processing Error",
-                f"An unexpected error occurred while communicating with the AI: {str(e)}",
-                parent=self.root
-            ))
-            self.root.after(0, lambda: self.status_bar.config(text=f"AI Error: {str(e)[:50]}..."))
+                f"An unexpected error occurred while communicating with the AI: {str(e)}"
+            )
+            status_message = f"AI Error: {str(e)[:50]}..."
         finally:
-            # Re-enable AI button and reset processing flag
-            self.root.after(0, self._reset_ai_interaction)
+            self.root.after(0, self._finish_ai_request, preview, error, status_message)
+            
+    def _shift_edit_lines(self, edit_suggestions, line_offset):
+        """Map line numbers of edits to a code excerpt back to the full file"""
+        if line_offset:
+            for edit in edit_suggestions:
+                edit.line_start += line_offset
+                edit.line_end += line_offset
+                
+    async def _stream_ai_response(self, ai_prompt):
+        """Stream the AI response chunk by chunk and return the full text"""
+        chunks = []
+        received = 0
+        stream = await self.gemini_client.aio.models.generate_content_stream(
+            model=GEMINI_MODEL_NAME,
+            contents=ai_prompt
+        )
+        async for chunk in stream:
+            # .text joins the chunk's parts on every access, so read it once
+            text = chunk.text
+            if text:
+                chunks.append(text)
+                received += len(text)
+                self.root.after(0, self._update_ai_progress, received)
+        return ''.join(chunks)
+        
+    def _update_ai_progress(self, received_chars):
+        """Show streaming progress while the AI response arrives"""
+        if self.is_ai_processing:
+            self.status_bar.config(text=f"Receiving AI response... ({received_chars} characters)")
             
     def _reset_ai_interaction(self, status_message: Optional[str] = None):
         """Reset AI button state, processing flag, and optionally update status bar."""
-        self.ask_ai_btn.config(state='normal', text="🤖 Ask AI")
+        self.ask_ai_btn.config(state='normal', text="Ask AI")
         self.is_ai_processing = False
         if status_message:
             self.status_bar.config(text=status_message)
         
+    def _finish_ai_request(self, preview, error, status_message):
+        """Reset the AI controls and show the request's outcome on the main thread"""
+        self._reset_ai_interaction(status_message)
+        if error is not None:
+            messagebox.showerror(*error, parent=self.root)
+        elif preview is not None:
+            self.show_edit_preview(*preview)
+            
     def show_edit_preview(self, analysis, edit_suggestions):
         """Show edit preview dialog"""
+        # Local aliases for the style constants used below
+        BG_MAIN = ModernStyle.BG_MAIN
+        BG_PANEL = ModernStyle.BG_PANEL
+        TEXT_SECONDARY = ModernStyle.TEXT_SECONDARY
+        FONT_MAIN = ModernStyle.FONT_MAIN
+        TEXT_PRIMARY = ModernStyle.TEXT_PRIMARY
+        FONT_LARGE = ModernStyle.FONT_LARGE
+        BG_HOVER = ModernStyle.BG_HOVER
+        FONT_SMALL = ModernStyle.FONT_SMALL
+        ACCENT_GREEN = ModernStyle.ACCENT_GREEN
+        
         if not edit_suggestions:
             # Parent for this messagebox should be self.root as preview_window doesn't exist.
             messagebox.showinfo("No Changes", "AI didn't suggest any changes for your request.", parent=self.root)
             self.status_bar.config(text="AI found no changes to suggest for your request.")
-            # _reset_ai_interaction is already called in the finally block of _process_ai_request
+            # _finish_ai_request has already reset the AI controls
             return
             
         preview_window = tk.Toplevel(self.root)
         preview_window.title("AI Edit Suggestions")
         preview_window.geometry("900x700")
-        preview_window.configure(bg=ModernStyle.BG_MAIN)
+        preview_window.configure(bg=BG_MAIN)
         preview_window.transient(self.root)
         preview_window.grab_set()
         
         # Main frame
-        main_frame = tk.Frame(preview_window, bg=ModernStyle.BG_MAIN)
+        main_frame = tk.Frame(preview_window, bg=BG_MAIN)
         main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         # Analysis section
-        analysis_frame = tk.Frame(main_frame, bg=ModernStyle.BG_PANEL, relief='solid', bd=1)
+        analysis_frame = tk.Frame(main_frame, bg=BG_PANEL, relief='solid', bd=1)
         analysis_frame.pack(fill=tk.X, pady=(0, 10))
         
         tk.Label(
             analysis_frame,
             text=analysis,
-            bg=ModernStyle.BG_PANEL,
-            fg=ModernStyle.TEXT_SECONDARY,
-            font=ModernStyle.FONT_MAIN,
+            bg=BG_PANEL,
+            fg=TEXT_SECONDARY,
+            font=FONT_MAIN,
             wraplength=850,
             justify='left'
         ).pack(anchor='w', padx=10, pady=(0, 10))
         
         # Edit suggestions section
-        suggestions_frame = tk.Frame(main_frame, bg=ModernStyle.BG_MAIN)
+        suggestions_frame = tk.Frame(main_frame, bg=BG_MAIN)
         suggestions_frame.pack(fill=tk.BOTH, expand=True)
         
         # Header with controls
-        header_frame = tk.Frame(suggestions_frame, bg=ModernStyle.BG_MAIN)
+        header_frame = tk.Frame(suggestions_frame, bg=BG_MAIN)
         header_frame.pack(fill=tk.X, pady=(0, 10))
         
         tk.Label(
             header_frame,
             text=f"Edit Suggestions ({len(edit_suggestions)} changes):",
-            bg=ModernStyle.BG_MAIN,
-            fg=ModernStyle.TEXT_PRIMARY,
-            font=ModernStyle.FONT_LARGE
+            bg=BG_MAIN,
+            fg=TEXT_PRIMARY,
+            font=FONT_LARGE
         ).pack(side=tk.LEFT)
         
         # Bulk selection buttons
-        btn_frame = tk.Frame(header_frame, bg=ModernStyle.BG_MAIN)
+        btn_frame = tk.Frame(header_frame, bg=BG_MAIN)
         btn_frame.pack(side=tk.RIGHT)
         
         tk.Button(
             btn_frame,
             text="Select All",
             command=lambda: self.toggle_all_edits(edit_suggestions, True),
-            bg=ModernStyle.BG_HOVER,
-            fg=ModernStyle.TEXT_PRIMARY,
-            font=ModernStyle.FONT_SMALL,
+            bg=BG_HOVER,
+            fg=TEXT_PRIMARY,
+            font=FONT_SMALL,
             relief='flat',
             padx=10
         ).pack(side=tk.LEFT, padx=2)
@@ -803,45 +1390,54 @@ User request: {prompt}"""
             btn_frame,
             text="Select None",
             command=lambda: self.toggle_all_edits(edit_suggestions, False),
-            bg=ModernStyle.BG_HOVER,
-            fg=ModernStyle.TEXT_PRIMARY,
-            font=ModernStyle.FONT_SMALL,
+            bg=BG_HOVER,
+            fg=TEXT_PRIMARY,
+            font=FONT_SMALL,
             relief='flat',
             padx=10
         ).pack(side=tk.LEFT, padx=2)
         
         # Scrollable frame for edit cards
-        canvas = tk.Canvas(suggestions_frame, bg=ModernStyle.BG_MAIN, highlightthickness=0)
+        canvas = tk.Canvas(suggestions_frame, bg=BG_MAIN, highlightthickness=0)
         scrollbar = tk.Scrollbar(suggestions_frame, orient="vertical", command=canvas.yview)
-        scrollable_frame = tk.Frame(canvas, bg=ModernStyle.BG_MAIN)
+        scrollable_frame = tk.Frame(canvas, bg=BG_MAIN)
+        
+        # Selection state exists for every edit, but cards are only built in
+        # batches as the list is scrolled towards its end
+        self.edit_checkboxes = {
+            i: tk.BooleanVar(value=edit.selected) for i, edit in enumerate(edit_suggestions)
+        }
+        self._edit_cards_built = 0
+        self._edit_cards_pending = False
         
+        # Create the first cards while the frame is still unmapped, so Tk lays
+        # them out in one pass once the frame is embedded in the canvas
+        self._build_edit_cards(scrollable_frame, edit_suggestions)
+            
+        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
         scrollable_frame.bind(
             "<Configure>",
             lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
         )
-        
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
+        canvas.configure(
+            yscrollcommand=lambda first, last: self._on_edit_cards_yview(
+                scrollbar, scrollable_frame, edit_suggestions, first, last)
+        )
         
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
         
-        # Create edit cards
-        self.edit_checkboxes = {}
-        for i, edit in enumerate(edit_suggestions):
-            self.create_edit_card(scrollable_frame, edit, i)
-            
         # Action buttons
-        action_frame = tk.Frame(main_frame, bg=ModernStyle.BG_MAIN)
+        action_frame = tk.Frame(main_frame, bg=BG_MAIN)
         action_frame.pack(fill=tk.X, pady=(10, 0))
         
         tk.Button(
             action_frame,
             text="Apply Selected Changes",
             command=lambda: self.apply_selected_edits(edit_suggestions, preview_window),
-            bg=ModernStyle.ACCENT_GREEN,
-            fg=ModernStyle.TEXT_PRIMARY,
-            font=ModernStyle.FONT_MAIN,
+            bg=ACCENT_GREEN,
+            fg=TEXT_PRIMARY,
+            font=FONT_MAIN,
             relief='flat',
             padx=20,
             pady=8
@@ -851,40 +1447,68 @@ User request: {prompt}"""
             action_frame,
             text="Cancel",
             command=preview_window.destroy,
-            bg=ModernStyle.BG_HOVER,
-            fg=ModernStyle.TEXT_PRIMARY,
-            font=ModernStyle.FONT_MAIN,
+            bg=BG_HOVER,
+            fg=TEXT_PRIMARY,
+            font=FONT_MAIN,
             relief='flat',
             padx=20,
             pady=8
         ).pack(side=tk.RIGHT, padx=5)
         
+    def _on_edit_cards_yview(self, scrollbar, parent, edit_suggestions, first, last):
+        """Keep the preview scrollbar in sync and build more cards near the end"""
+        scrollbar.set(first, last)
+        if (float(last) >= 0.9 and not self._edit_cards_pending
+                and self._edit_cards_built < len(edit_suggestions)):
+            self._edit_cards_pending = True
+            self.root.after_idle(self._build_edit_cards, parent, edit_suggestions)
+            
+    def _build_edit_cards(self, parent, edit_suggestions):
+        """Create the next batch of edit cards in the preview"""
+        self._edit_cards_pending = False
+        if not parent.winfo_exists():
+            return  # The preview was closed before the batch ran
+            
+        start = self._edit_cards_built
+        end = min(start + EDIT_CARD_BATCH_SIZE, len(edit_suggestions))
+        for i in range(start, end):
+            self.create_edit_card(parent, edit_suggestions[i], i)
+        self._edit_cards_built = end
+        
     def create_edit_card(self, parent, edit, index):
         """Create a card for displaying an edit suggestion"""
+        # Local aliases for the style constants used below
+        BG_PANEL = ModernStyle.BG_PANEL
+        TEXT_PRIMARY = ModernStyle.TEXT_PRIMARY
+        BG_HOVER = ModernStyle.BG_HOVER
+        TEXT_TERTIARY = ModernStyle.TEXT_TERTIARY
+        FONT_SMALL = ModernStyle.FONT_SMALL
+        FONT_MAIN = ModernStyle.FONT_MAIN
+        BG_MAIN = ModernStyle.BG_MAIN
+        ACCENT_RED = ModernStyle.ACCENT_RED
+        ACCENT_GREEN = ModernStyle.ACCENT_GREEN
+        
         card_frame = tk.Frame(
             parent, 
-            bg=ModernStyle.BG_PANEL, 
+            bg=BG_PANEL, 
             relief='solid', 
             bd=1
         )
         card_frame.pack(fill=tk.X, pady=5, padx=5)
         
         # Header with checkbox and info
-        header_frame = tk.Frame(card_frame, bg=ModernStyle.BG_PANEL)
+        header_frame = tk.Frame(card_frame, bg=BG_PANEL)
         header_frame.pack(fill=tk.X, padx=10, pady=5)
         
         # Checkbox
-        checkbox_var = tk.BooleanVar(value=edit.selected)
-        self.edit_checkboxes[index] = checkbox_var
-        
         checkbox = tk.Checkbutton(
             header_frame,
-            variable=checkbox_var,
-            bg=ModernStyle.BG_PANEL,
-            fg=ModernStyle.TEXT_PRIMARY,
-            selectcolor=ModernStyle.BG_HOVER,
-            activebackground=ModernStyle.BG_PANEL,
-            activeforeground=ModernStyle.TEXT_PRIMARY
+            variable=self.edit_checkboxes[index],
+            bg=BG_PANEL,
+            fg=TEXT_PRIMARY,
+            selectcolor=BG_HOVER,
+            activebackground=BG_PANEL,
+            activeforeground=TEXT_PRIMARY
         )
         checkbox.pack(side=tk.LEFT)
         
@@ -893,209 +1517,146 @@ User request: {prompt}"""
         tk.Label(
             header_frame,
             text=info_text,
-            bg=ModernStyle.BG_PANEL,
-            fg=ModernStyle.TEXT_TERTIARY,
-            font=ModernStyle.FONT_SMALL
+            bg=BG_PANEL,
+            fg=TEXT_TERTIARY,
+            font=FONT_SMALL
         ).pack(side=tk.LEFT, padx=(5, 0))
         
         # Explanation
         tk.Label(
             card_frame,
             text=edit.explanation,
-            bg=ModernStyle.BG_PANEL,
-            fg=ModernStyle.TEXT_PRIMARY,
-            font=ModernStyle.FONT_MAIN,
+            bg=BG_PANEL,
+            fg=TEXT_PRIMARY,
+            font=FONT_MAIN,
             wraplength=800,
             justify='left'
         ).pack(fill=tk.X, padx=10, pady=(0, 5))
         
         # Code diff section
-        diff_frame = tk.Frame(card_frame, bg=ModernStyle.BG_MAIN)
+        diff_frame = tk.Frame(card_frame, bg=BG_MAIN)
         diff_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
         
         if edit.edit_type == 'replace':
-            # Show original code (red background)
+            # Show original code (red background), then suggested code (green background)
             if edit.original_code.strip():
-                original_frame = tk.Frame(diff_frame, bg=ModernStyle.ACCENT_RED)
-                original_frame.pack(fill=tk.X, pady=1)
-                
-                tk.Label(
-                    original_frame,
-                    text="- Remove:",
-                    bg=ModernStyle.ACCENT_RED,
-                    fg=ModernStyle.TEXT_PRIMARY,
-                    font=ModernStyle.FONT_SMALL
-                ).pack(anchor='w', padx=5, pady=2)
-                
-                tk.Text(
-                    original_frame,
-                    height=min(3, edit.original_code.count('\n') + 1),
-                    bg='#2d1b1b',
-                    fg=ModernStyle.TEXT_PRIMARY,
-                    font=ModernStyle.FONT_CODE,
-                    wrap=tk.NONE,
-                    state='normal'
-                ).pack(fill=tk.X, padx=5, pady=2)
-                
-                original_text = original_frame.winfo_children()[-1]
-                original_text.insert('1.0', edit.original_code)
-                original_text.config(state='disabled')
-            
-            # Show suggested code (green background)
+                self._build_diff_block(diff_frame, "- Remove:", ACCENT_RED, 'removedCode',
+                                       edit.original_code, edit.original_line_count)
             if edit.suggested_code.strip():
-                suggested_frame = tk.Frame(diff_frame, bg=ModernStyle.ACCENT_GREEN)
-                suggested_frame.pack(fill=tk.X, pady=1)
-                
-                tk.Label(
-                    suggested_frame,
-                    text="+ Add:",
-                    bg=ModernStyle.ACCENT_GREEN,
-                    fg=ModernStyle.TEXT_PRIMARY,
-                    font=ModernStyle.FONT_SMALL
-                ).pack(anchor='w', padx=5, pady=2)
-                
-                tk.Text(
-                    suggested_frame,
-                    height=min(3, edit.suggested_code.count('\n') + 1),
-                    bg='#1b2d1b',
-                    fg=ModernStyle.TEXT_PRIMARY,
-                    font=ModernStyle.FONT_CODE,
-                    wrap=tk.NONE,
-                    state='normal'
-                ).pack(fill=tk.X, padx=5, pady=2)
-                
-                suggested_text = suggested_frame.winfo_children()[-1]
-                suggested_text.insert('1.0', edit.suggested_code)
-                suggested_text.config(state='disabled')
+                self._build_diff_block(diff_frame, "+ Add:", ACCENT_GREEN, 'addedCode',
+                                       edit.suggested_code, edit.suggested_line_count)
                 
         elif edit.edit_type == 'insert':
             # Show only suggested code for insertions
-            suggested_frame = tk.Frame(diff_frame, bg=ModernStyle.ACCENT_GREEN)
-            suggested_frame.pack(fill=tk.X, pady=1)
-            
-            tk.Label(
-                suggested_frame,
-                text=f"+ Insert at line {edit.line_start}:",
-                bg=ModernStyle.ACCENT_GREEN,
-                fg=ModernStyle.TEXT_PRIMARY,
-                font=ModernStyle.FONT_SMALL
-            ).pack(anchor='w', padx=5, pady=2)
-            
-            tk.Text(
-                suggested_frame,
-                height=min(3, edit.suggested_code.count('\n') + 1),
-                bg='#1b2d1b',
-                fg=ModernStyle.TEXT_PRIMARY,
-                font=ModernStyle.FONT_CODE,
-                wrap=tk.NONE,
-                state='normal'
-            ).pack(fill=tk.X, padx=5, pady=2)
-            
-            suggested_text = suggested_frame.winfo_children()[-1]
-            suggested_text.insert('1.0', edit.suggested_code)
-            suggested_text.config(state='disabled')
+            self._build_diff_block(diff_frame, f"+ Insert at line {edit.line_start}:", ACCENT_GREEN,
+                                   'addedCode', edit.suggested_code, edit.suggested_line_count)
             
         elif edit.edit_type == 'delete':
             # Show only original code for deletions
-            original_frame = tk.Frame(diff_frame, bg=ModernStyle.ACCENT_RED)
-            original_frame.pack(fill=tk.X, pady=1)
-            
-            tk.Label(
-                original_frame,
-                text=f"- Delete lines {edit.line_start}-{edit.line_end}:",
-                bg=ModernStyle.ACCENT_RED,
-                fg=ModernStyle.TEXT_PRIMARY,
-                font=ModernStyle.FONT_SMALL
-            ).pack(anchor='w', padx=5, pady=2)
+            self._build_diff_block(diff_frame, f"- Delete lines {edit.line_start}-{edit.line_end}:",
+                                   ACCENT_RED, 'removedCode', edit.original_code, edit.original_line_count)
             
-            tk.Text(
-                original_frame,
-                height=min(3, edit.original_code.count('\n') + 1),
-                bg='#2d1b1b',
-                fg=ModernStyle.TEXT_PRIMARY,
-                font=ModernStyle.FONT_CODE,
-                wrap=tk.NONE,
-                state='normal'
-            ).pack(fill=tk.X, padx=5, pady=2)
-            
-            original_text = original_frame.winfo_children()[-1]
-            original_text.insert('1.0', edit.original_code)
-            original_text.config(state='disabled')
+    def _build_diff_block(self, parent, header_text, frame_bg, text_name, code, line_count):
+        """Add a labelled, read-only code box to an edit card's diff section"""
+        block_frame = tk.Frame(parent, bg=frame_bg)
+        block_frame.pack(fill=tk.X, pady=1)
+        
+        tk.Label(
+            block_frame,
+            text=header_text,
+            bg=frame_bg,
+            fg=ModernStyle.TEXT_PRIMARY,
+            font=ModernStyle.FONT_SMALL
+        ).pack(anchor='w', padx=5, pady=2)
+        
+        # Colours and font come from the option database entry for text_name
+        code_text = tk.Text(
+            block_frame,
+            name=text_name,
+            height=min(3, line_count)
+        )
+        code_text.pack(fill=tk.X, padx=5, pady=2)
+        code_text.insert('1.0', code)
+        code_text.config(state='disabled')
             
     def toggle_all_edits(self, edit_suggestions, select_all):
         """Toggle all edit selections"""
-        for i in range(len(edit_suggestions)):
-            if i in self.edit_checkboxes:
-                self.edit_checkboxes[i].set(select_all)
-                edit_suggestions[i].selected = select_all
+        for i, checkbox_var in self.edit_checkboxes.items():
+            checkbox_var.set(select_all)
+            edit_suggestions[i].selected = select_all
                 
     def apply_selected_edits(self, edit_suggestions, preview_window):
         """Apply the selected edits to the code"""
         # Get selected edits
-        selected_edits = []
-        for i, edit in enumerate(edit_suggestions):
-            if i in self.edit_checkboxes and self.edit_checkboxes[i].get():
-                selected_edits.append(edit)
+        selected_edits = [
+            edit_suggestions[i] for i, checkbox_var in self.edit_checkboxes.items() if checkbox_var.get()
+        ]
                 
         if not selected_edits:
             messagebox.showwarning("No Selection", "Please select at least one edit to apply.", parent=preview_window)
             return
             
-        # Sort edits by line number (descending) to avoid line number shifts
-        selected_edits.sort(key=lambda x: x.line_start, reverse=True)
+        # Sort edits by line number so overlapping ranges can be detected; an
+        # insert goes before a replace/delete starting on the same line
+        selected_edits.sort(key=lambda x: (x.line_start, x.edit_type != 'insert'))
         
         # Apply edits
         try:
-            current_lines = self.code_text.get('1.0', 'end-1c').split('\n')
+            code_text = self.code_text
+            line_count = int(code_text.index('end-1c').split('.')[0])
+            valid_edits = []
+            covered_to = 0  # Index of the first line not covered by an earlier edit
             
             for edit in selected_edits:
-                # Line numbers from AI are 1-based, convert to 0-based for list indexing
+                # Line numbers from AI are 1-based, convert to 0-based for validation
                 start_index = edit.line_start - 1
                 end_index = edit.line_end - 1 # For deletion/replacement, this is the last line to remove
 
-                if edit.edit_type == 'replace':
-                    # Validate line numbers
-                    if not (0 <= start_index < len(current_lines) and 0 <= end_index < len(current_lines) and start_index <= end_index):
-                        print(f"Warning: Invalid line numbers for replace: {edit.line_start}-{edit.line_end}. Skipping edit.")
-                        continue
-
-                    # Remove original lines (from start_index to end_index inclusive)
-                    del current_lines[start_index : end_index + 1]
+                if edit.edit_type == 'insert':
+                    # Insertion happens *before* this line, so line_start 1 inserts
+                    # at the top and line_count + 1 appends at the end
+                    if not (covered_to <= start_index <= line_count):
+                        continue  # Out of range or inside an earlier edit
+                    covered_to = start_index
                     
-                    # Insert new lines (split suggested code into lines)
-                    suggested_lines = edit.suggested_code.split('\n')
-                    for i, line_content in enumerate(suggested_lines):
-                        current_lines.insert(start_index + i, line_content)
-                        
-                elif edit.edit_type == 'insert':
-                    # Validate line number (insertion happens *before* this line)
-                    # So, if line_start is 1, it inserts at index 0.
-                    # If line_start is len(current_lines) + 1, it inserts at the end.
-                    insert_at_index = edit.line_start - 1
-                    if not (0 <= insert_at_index <= len(current_lines)):
-                        print(f"Warning: Invalid line number for insert: {edit.line_start}. Skipping edit.")
+                elif edit.edit_type in ('replace', 'delete'):
+                    # Validate line numbers; ranges overlapping an earlier edit are skipped too
+                    if not (covered_to <= start_index <= end_index < line_count):
                         continue
-
-                    suggested_lines = edit.suggested_code.split('\n')
-                    for i, line_content in enumerate(suggested_lines):
-                        current_lines.insert(insert_at_index + i, line_content)
+                    covered_to = end_index + 1
                     
-                elif edit.edit_type == 'delete':
-                    # Validate line numbers
-                    if not (0 <= start_index < len(current_lines) and 0 <= end_index < len(current_lines) and start_index <= end_index):
-                        print(f"Warning: Invalid line numbers for delete: {edit.line_start}-{edit.line_end}. Skipping edit.")
-                        continue
-                        
-                    # Delete lines (from start_index to end_index inclusive)
-                    del current_lines[start_index : end_index + 1]
-            
-            # Update the editor
-            new_content = '\n'.join(current_lines)
-            self.code_text.delete('1.0', 'end')
-            self.code_text.insert('1.0', new_content)
+                else:
+                    continue
+                valid_edits.append(edit)
+                
+            # Edit the Tk buffer in place, bottom-up so earlier line numbers stay
+            # valid, as a single undo step
+            code_text.config(autoseparators=False)
+            code_text.edit_separator()
+            try:
+                for edit in reversed(valid_edits):
+                    last_line = int(code_text.index('end-1c').split('.')[0])
+                    if edit.edit_type == 'insert':
+                        if edit.line_start > last_line:
+                            code_text.insert('end-1c', '\n' + edit.suggested_code)
+                        else:
+                            code_text.insert(f"{edit.line_start}.0", edit.suggested_code + '\n')
+                    elif edit.edit_type == 'replace':
+                        code_text.replace(f"{edit.line_start}.0", f"{edit.line_end}.end", edit.suggested_code)
+                    elif edit.line_end < last_line:
+                        code_text.delete(f"{edit.line_start}.0", f"{edit.line_end + 1}.0")
+                    elif edit.line_start > 1:
+                        # Deleting through the last line also removes the newline before it
+                        code_text.delete(f"{edit.line_start - 1}.end", 'end-1c')
+                    else:
+                        code_text.delete('1.0', 'end-1c')
+            finally:
+                code_text.edit_separator()
+                code_text.config(autoseparators=True)
+            self._edit_generation += 1  # <<Modified>> arrives later; drop the cached text now
             
             # Update UI
-            self.update_line_numbers()
+            self.schedule_line_numbers_update(idle=True)
             self.is_modified = True
             self.update_title()
             
@@ -1103,7 +1664,11 @@ User request: {prompt}"""
             preview_window.destroy()
             
             # Show success message
-            self.status_bar.config(text=f"Applied {len(selected_edits)} changes successfully")
+            status_message = f"Applied {len(valid_edits)} changes successfully"
+            skipped = len(selected_edits) - len(valid_edits)
+            if skipped:
+                status_message += f" ({skipped} skipped: invalid or overlapping line numbers)"
+            self.status_bar.config(text=status_message)
             
             # Clear AI prompt
             self.ai_prompt_var.set("")
@@ -1126,28 +1691,33 @@ User request: {prompt}"""
         if new_key:
             self.api_key = new_key
             self.setup_gemini()
+            if self._configured_key == new_key:
+                _save_api_key(new_key)
             
     def test_ai_connection(self):
         """Test the AI connection"""
         if not GENAI_AVAILABLE:
-            messagebox.showerror("Error", "Gemini AI library not available. Please install 'google-generativeai'.", parent=self.root)
+            messagebox.showerror("Error", "Gemini AI library not available. Please install 'google-genai'.", parent=self.root)
             return
 
         if not self.api_key:
             messagebox.showerror("Error", "API key not set. Please configure your API key first.", parent=self.root)
             return
 
-        if not self.gemini_model:
+        if not self.gemini_client:
             messagebox.showerror("Error", "AI model not initialized. This might be due to an invalid API key or connection issue during setup.", parent=self.root)
             # Optionally, try to re-initialize
             # self.setup_gemini() 
-            # if not self.gemini_model:
+            # if not self.gemini_client:
             #     return # Still not initialized
             return
             
         try:
             self.status_bar.config(text="Testing AI connection...")
-            test_response = self.gemini_model.generate_content("Hello, please respond with 'Connection successful'")
+            test_response = self.gemini_client.models.generate_content(
+                model=GEMINI_MODEL_NAME,
+                contents="Hello, please respond with 'Connection successful'"
+            )
             
             if "Connection successful" in test_response.text:
                 messagebox.showinfo("Connection Test Successful", f"AI Response: {test_response.text}", parent=self.root)
@@ -1162,9 +1732,7 @@ User request: {prompt}"""
             
     def on_enter_pressed(self, event):
         """Handle Enter key press in AI prompt"""
-        if (event.widget == self.ai_prompt_entry and 
-            not self.is_ai_processing and 
-            self.ai_prompt_var.get().strip()):
+        if not self.is_ai_processing and self.ai_prompt_var.get().strip():
             self.ask_ai()
             
     def on_closing(self):
@@ -1179,60 +1747,155 @@ User request: {prompt}"""
         self.root.mainloop()
 
 
+def _pip_install_command(packages):
+    """Build the single pip command that installs all missing dependencies"""
+    return [
+        sys.executable, "-m", "pip", "install",
+        "--no-input", "--disable-pip-version-check",
+        # Take wheels over newer sdists so no package has to be built locally
+        "--prefer-binary",
+        *packages
+    ]
+
+def _run_pip_with_progress(root, packages):
+    """Run the bootstrap pip install, showing its progress in root.
+    
+    pip's output is read on a worker thread and drained by the Tk loop, which
+    runs until pip exits. Returns pip's exit code and its last output lines.
+    """
+    import subprocess
+    
+    root.title("Installing Dependencies")
+    root.protocol("WM_DELETE_WINDOW", lambda: None)  # Can't cancel mid-install
+    status_label = tk.Label(root, text=f"Installing {', '.join(packages)}...", anchor='w', width=60)
+    status_label.pack(fill=tk.X, padx=10, pady=(10, 5))
+    progress = ttk.Progressbar(root, mode='determinate', maximum=100, length=400)
+    progress.pack(fill=tk.X, padx=10, pady=(0, 10))
+    root.deiconify()
+    
+    process = subprocess.Popen(
+        _pip_install_command(packages),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1
+    )
+    # deque.append/popleft are atomic, so the reader thread and the Tk poll
+    # can share it without the locking a queue.Queue does on every call
+    output_lines = deque()
+    
+    def read_output():
+        with process.stdout:
+            for line in process.stdout:
+                output_lines.append(line)
+                
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+    
+    output_tail = deque(maxlen=20)
+    counts = {'collected': 0, 'fetched': 0}
+    poll_delay = PIP_POLL_MIN_MS
+    
+    def drain_output():
+        nonlocal poll_delay
+        # Poll quickly while pip is printing and back off while it is quiet
+        # (e.g. building or unpacking a large wheel)
+        poll_delay = PIP_POLL_MIN_MS if output_lines else min(poll_delay * 2, PIP_POLL_MAX_MS)
+        for _ in range(min(64, len(output_lines))):
+            line = output_lines.popleft()
+            output_tail.append(line)
+            match = _PIP_PROGRESS_RE.match(line)
+            if not match:
+                continue
+            step, name = match.groups()
+            if step == 'Collecting':
+                counts['collected'] += 1
+                status_label.config(text=f"Collecting {name}")
+            elif step in ('Downloading', 'Using cached'):
+                counts['fetched'] += 1
+            elif step == 'Installing collected packages':
+                status_label.config(text="Installing packages...")
+                progress['value'] = 90
+                continue
+            else:
+                progress['value'] = 100
+                continue
+            # Transitive dependencies keep adding to the total while pip resolves
+            progress['value'] = 80 * counts['fetched'] / max(counts['collected'], 1)
+            
+        if process.poll() is None or reader.is_alive() or output_lines:
+            root.after(poll_delay, drain_output)
+        else:
+            root.quit()
+            
+    root.after(poll_delay, drain_output)
+    root.mainloop()
+    return process.returncode, ''.join(output_tail)
+
 def main():
     """Main function to run the application"""
-    # Check for required dependencies
-    missing_core_deps = []
-    if not GENAI_AVAILABLE:
-        missing_core_deps.append("google-generativeai")
-    # Pygments is for syntax highlighting, potentially optional but good to have.
-    # For now, let's treat it as core for the app's intended functionality.
-    if not PYGMENTS_AVAILABLE:
-        missing_core_deps.append("Pygments") # Package name for pip install
+    # Check for required dependencies; find_spec only looks them up on disk
+    missing_core_deps = [
+        package for module, package in CORE_DEPENDENCIES
+        if not _module_available(module)
+    ]
     
     if missing_core_deps:
         missing_deps_str = ", ".join(missing_core_deps)
+        manual_command = f"pip install {' '.join(missing_core_deps)}"
         message = (
             f"Critical dependencies missing: {missing_deps_str}.\n\n"
             "The application will attempt to install them now. "
             "This may take a moment.\n\n"
             "If this fails, please install them manually by running:\n"
-            f"pip install {' '.join(missing_core_deps)}\n\n"
+            f"{manual_command}\n\n"
             "Do you want to proceed with automatic installation?"
         )
         
-        # Need a temporary root for messagebox if app hasn't started
-        # However, this main() is before app = AICodeEditor(), so no Tk root yet.
-        # Print to console is the most straightforward here.
-        print(message.replace("\n\n", "\n")) # Condense for console
-        
-        # For a GUI app, a simple console prompt for this is okay before GUI starts.
-        # Or, we could pop a simple Tk dialog if Tk is available at this stage.
-        # For now, let's assume console interaction for this pre-flight check.
-        proceed = input("Proceed with installation? (yes/no): ").strip().lower()
-
-        if proceed == 'yes' or proceed == 'y':
-            print(f"\nAttempting to install: {missing_deps_str}...")
-            try:
-                subprocess.check_call([sys.executable, "-m", "pip", "install"] + missing_core_deps)
-                print("\nDependencies installed successfully.")
-                print("Please restart the application for changes to take effect.")
-                # Inform that a restart is needed.
-                # For a GUI, could show a messagebox here, but console is fine.
-                # simpledialog won't work without a root window.
-                return # Exit after installing, user needs to restart
-            except subprocess.CalledProcessError as e:
-                print(f"\nError: Failed to install dependencies automatically: {e}")
-                print(f"Please manually run: pip install {' '.join(missing_core_deps)}")
-                return # Exit, cannot run without dependencies
-            except FileNotFoundError: # E.g. pip not found
-                print("\nError: 'pip' command not found. Please ensure pip is installed and in your PATH.")
-                print(f"Please manually run: pip install {' '.join(missing_core_deps)}")
-                return
-        else:
-            print("\nInstallation cancelled by user. Application cannot start without dependencies.")
-            print(f"Please manually run: pip install {' '.join(missing_core_deps)}")
+        # A hidden root lets the pre-flight check use Tk dialogs before the
+        # application window exists
+        root = tk.Tk()
+        root.withdraw()
+        if not messagebox.askyesno("Missing Dependencies", message, parent=root):
+            messagebox.showinfo(
+                "Installation Cancelled",
+                "The application cannot start without its dependencies.\n\n"
+                f"Please manually run: {manual_command}",
+                parent=root
+            )
+            root.destroy()
             return # Exit
+            
+        try:
+            returncode, pip_output = _run_pip_with_progress(root, missing_core_deps)
+        except FileNotFoundError: # E.g. pip not found
+            messagebox.showerror(
+                "Installation Failed",
+                "'pip' command not found. Please ensure pip is installed and in your PATH.\n\n"
+                f"Please manually run: {manual_command}",
+                parent=root
+            )
+            root.destroy()
+            return
+            
+        if returncode != 0:
+            messagebox.showerror(
+                "Installation Failed",
+                f"Failed to install dependencies automatically (pip exit code {returncode}):\n\n"
+                f"{pip_output}\n"
+                f"Please manually run: {manual_command}",
+                parent=root
+            )
+            root.destroy()
+            return # Exit, cannot run without dependencies
+            
+        # Relaunch so the new packages are importable, instead of asking the
+        # user to. os.execv doesn't quote arguments on Windows, so paths with
+        # spaces would be split.
+        import subprocess
+        root.destroy()
+        subprocess.Popen([sys.executable, *sys.argv])
+        return
 
     # Create and run the application
     app = AICodeEditor()